@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-import glob
 import os
+import queue
 import tkinter as tk
+from concurrent.futures import Future, ThreadPoolExecutor
 from tkinter import filedialog, messagebox, simpledialog, ttk
 from dotenv import load_dotenv, find_dotenv
 from ConversationManager import ConversationManager
@@ -10,6 +11,7 @@ from ConversationManager import ConversationManager
 load_dotenv("OPENAI_API_KEY.env")
 
 HISTORY_DIR = "history"
+POLL_INTERVAL_MS = 30
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # -----------------------------------------------------------------------------
@@ -23,7 +25,12 @@ class ChatGUI(tk.Tk):
         self.geometry("900x600")
 
         self.cm: ConversationManager | None = None
-        self._history_files: list[str] = []
+        self._history_files: dict[str, str] = {}  # path -> list label
+        self._pool = ThreadPoolExecutor(max_workers=2)
+        self._pending_flushes: dict[Future, ConversationManager] = {}
+        self._inflight: Future | None = None
+
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
 
         self.build_layout()
         self.refresh_history_list()
@@ -41,7 +48,7 @@ class ChatGUI(tk.Tk):
             textvariable=self.persona_var,
             state="readonly",
             width=20,
-            values=list(ConversationManager.system_messages.keys()),
+            values=(*ConversationManager.PERSONA_NAMES, "Custom"),
         )
         self.persona_combo.pack(fill=tk.X)
         self.persona_combo.bind("<<ComboboxSelected>>", self._on_persona_change)
@@ -56,12 +63,10 @@ class ChatGUI(tk.Tk):
 
         hist_btn_frame = ttk.Frame(sidebar)
         hist_btn_frame.pack(fill=tk.X, pady=4)
-        ttk.Button(hist_btn_frame, text="Load", command=self._load_selected_history).pack(
-            side=tk.LEFT, expand=True, fill=tk.X
-        )
-        ttk.Button(hist_btn_frame, text="New", command=self._start_new_chat).pack(
-            side=tk.LEFT, expand=True, fill=tk.X
-        )
+        self.load_btn = ttk.Button(hist_btn_frame, text="Load", command=self._load_selected_history)
+        self.load_btn.pack(side=tk.LEFT, expand=True, fill=tk.X)
+        self.new_btn = ttk.Button(hist_btn_frame, text="New", command=self._start_new_chat)
+        self.new_btn.pack(side=tk.LEFT, expand=True, fill=tk.X)
 
         main = ttk.Frame(self, padding=8)
         main.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
@@ -76,33 +81,39 @@ class ChatGUI(tk.Tk):
         self.user_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 4))
         self.user_entry.bind("<Return>", lambda _e: self._on_send())
 
-        send_btn = ttk.Button(entry_frame, text="Send", command=self._on_send)
-        send_btn.pack(side=tk.RIGHT)
+        self.send_btn = ttk.Button(entry_frame, text="Send", command=self._on_send)
+        self.send_btn.pack(side=tk.RIGHT)
 
     # -----------------------------------------------------------------------------
     # File History
     # -----------------------------------------------------------------------------
     def refresh_history_list(self) -> None:
         os.makedirs(HISTORY_DIR, exist_ok=True)
-        files = sorted(glob.glob(os.path.join(HISTORY_DIR, "*.json")))
-        self._history_files = files
+        with os.scandir(HISTORY_DIR) as it:
+            entries = [e for e in it if e.name.endswith(".json") and e.is_file()]
+        entries.sort(key=lambda e: e.name)
+        self._history_files = {e.path: e.name for e in entries}
 
         self.hist_list.delete(0, tk.END)
-        for f in files:
-            self.hist_list.insert(tk.END, os.path.basename(f))
+        for name in self._history_files.values():
+            self.hist_list.insert(tk.END, name)
 
-    def load_selected_history(self) -> None:
+    def _load_selected_history(self) -> None:
         selection = self.hist_list.curselection()
         if not selection:
             messagebox.showinfo("No selection", "Please select a history file from the list.")
             return
 
-        file_path = self._history_files[selection[0]]
+        file_path = list(self._history_files)[selection[0]]
+        if self.cm is not None and file_path == self.cm.history_file:
+            return  # already open; re-opening would race its pending flush
+
         self.init_cm(history_file=file_path)
         self.cm.load_conversation_history()
         self.redraw_chat_display()
+        self.refresh_history_list()
 
-    def start_new_chat(self) -> None:
+    def _start_new_chat(self) -> None:
         self.init_cm(history_file=None)
         self.redraw_chat_display()
         self.refresh_history_list()
@@ -110,7 +121,7 @@ class ChatGUI(tk.Tk):
     # -----------------------------------------------------------------------------
     # Persona Handling
     # -----------------------------------------------------------------------------
-    def on_persona_change(self, _event: object = None) -> None:
+    def _on_persona_change(self, _event: object = None) -> None:
         sel = self.persona_var.get()
 
         if sel == "Custom":
@@ -140,23 +151,103 @@ class ChatGUI(tk.Tk):
 
         self.append_system_line(f"[Persona switched to {sel}]")
 
-    def on_send(self) -> None:
+    def _on_send(self) -> None:
         text = self.user_entry.get().strip()
         if not text or self.cm is None:
             return
 
         self.user_entry.delete(0, tk.END)
         self.append_chat_line("You", text)
+        self.set_input_state(tk.DISABLED)
+        self.begin_stream_line("Assistant")
+
+        deltas: queue.Queue[str] = queue.Queue()
+        fut = self._pool.submit(self.cm.chat_completion_stream, text, deltas.put)
+        self._inflight = fut
+        self.after(POLL_INTERVAL_MS, self._poll_completion, fut, self.cm, deltas)
+
+    def _poll_completion(
+        self, fut: Future, cm: ConversationManager, deltas: queue.Queue[str]
+    ) -> None:
+        # Runs on the Tk main thread; the worker only feeds the queue and
+        # never touches widgets.
+        if cm is not self.cm:
+            # Chat was switched while the request was in flight; the reply's
+            # own save may have been debounced, so flush once it lands.
+            fut.add_done_callback(lambda _f: cm.flush())
+            self._inflight = None
+            self.set_input_state(tk.NORMAL)
+            return
+
+        done = fut.done()  # check before draining so no late delta is lost
+        pending: list[str] = []
+        while True:
+            try:
+                pending.append(deltas.get_nowait())
+            except queue.Empty:
+                break
+        if pending:
+            self.append_delta("".join(pending))  # one Tcl insert per tick
+
+        if not done:
+            self.after(POLL_INTERVAL_MS, self._poll_completion, fut, cm, deltas)
+            return
+
+        self.end_stream_line()
+        self._inflight = None
+        self.set_input_state(tk.NORMAL)
 
         try:
-            ai_text = self.cm.chat_completion(text)
-        except Exception as exc: 
+            fut.result()
+        except Exception as exc:
             messagebox.showerror("Error", f"API call failed:\n{exc}")
             return
 
-        self.append_chat_line("Assistant", ai_text)
+        # Only rescan the folder when the chat file is new or was renamed.
+        if cm.history_file not in self._history_files:
+            self.refresh_history_list()
+
+    def set_input_state(self, state: str) -> None:
+        # While a request is in flight, anything that switches or edits the
+        # chat is locked too: the worker is still reading and saving it.
+        self.user_entry.configure(state=state)
+        self.send_btn.configure(state=state)
+        self.load_btn.configure(state=state)
+        self.new_btn.configure(state=state)
+        self.persona_combo.configure(state="readonly" if state == tk.NORMAL else tk.DISABLED)
+
+    def _poll_flush(self, fut: Future) -> None:
+        # The flush may have renamed the chat file, so rescan once it lands.
+        if not fut.done():
+            self.after(POLL_INTERVAL_MS, self._poll_flush, fut)
+            return
+
+        self._pending_flushes.pop(fut, None)
+        try:
+            fut.result()
+        except Exception as exc:
+            messagebox.showerror("Error", f"Saving chat failed:\n{exc}")
         self.refresh_history_list()
 
+    def _on_close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for fut, cm in self._pending_flushes.items():
+            if fut.cancelled():
+                cm.flush()  # never got a worker; save it here instead
+        fut, cm = self._inflight, self.cm
+        if fut is not None and not fut.done():
+            # Let the reply finish and save once the window is gone.
+            fut.add_done_callback(lambda _f: self._close_cm(cm))
+        else:
+            self._close_cm(cm)
+        self.destroy()
+
+    @staticmethod
+    def _close_cm(cm: ConversationManager | None) -> None:
+        if cm is not None:
+            cm.close()
+        ConversationManager.close_shared_clients()
+
     # -----------------------------------------------------------------------------
     # Display Util
     # -----------------------------------------------------------------------------
@@ -166,6 +257,18 @@ class ChatGUI(tk.Tk):
         self.chat_display.configure(state="disabled")
         self.chat_display.see(tk.END)
 
+    def begin_stream_line(self, speaker: str) -> None:
+        self.append_delta(f"{speaker}: ")
+
+    def append_delta(self, text: str) -> None:
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert(tk.END, text)
+        self.chat_display.configure(state="disabled")
+        self.chat_display.see(tk.END)
+
+    def end_stream_line(self) -> None:
+        self.append_delta("\n\n")
+
     def append_system_line(self, msg: str) -> None:
         self.chat_display.configure(state="normal")
         self.chat_display.insert(tk.END, f"— {msg} —\n\n")
@@ -179,9 +282,11 @@ class ChatGUI(tk.Tk):
             self.chat_display.configure(state="disabled")
             return
 
-        for msg in self.cm.conversation_history:
-            role = msg["role"].capitalize()
-            self.chat_display.insert(tk.END, f"{role}: {msg['content']}\n\n")
+        # One insert for the whole history; each insert is a Tcl round-trip.
+        self.chat_display.insert(tk.END, "".join(
+            f"{msg['role'].capitalize()}: {msg['content']}\n\n"
+            for msg in self.cm.conversation_history
+        ))
         self.chat_display.configure(state="disabled")
         self.chat_display.see(tk.END)
 
@@ -193,11 +298,19 @@ class ChatGUI(tk.Tk):
         if persona_name in {"", "Choose…", "Custom"}:
             persona_name = None 
 
+        if self.cm is not None:
+            # Flushing may ask the API for a file name, so keep it off the
+            # Tk thread.
+            fut = self._pool.submit(self.cm.flush)
+            self._pending_flushes[fut] = self.cm
+            self.after(POLL_INTERVAL_MS, self._poll_flush, fut)
+
         self.cm = ConversationManager(
             api_key=os.getenv("OPENAI_API_KEY", ""),
             persona=persona_name,
             system_message=custom_msg,
             history_file=history_file,
+            prewarm=True,
         )
 
         if history_file is None:
@@ -1,9 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
+import importlib.util
+import math
 import os
-from typing import Optional
-import tiktoken
+import threading
+from collections import Counter, OrderedDict
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Mapping, Optional, Sequence
 import logging
 import datetime
+import email.utils
 import json
+import random
+import re
+import time
+import httpx
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+
+try:
+    import orjson
+except ImportError:  # optional: only speeds up cache-key hashing
+    orjson = None
+
+if TYPE_CHECKING:
+    import tiktoken
+
+ENCODE_THREADS = os.cpu_count() or 1
+KEEPALIVE_EXPIRY = 30.0
+CONNECT_TIMEOUT = 10.0
+# httpx only decodes brotli bodies with brotli/brotlicffi installed and only
+# speaks HTTP/2 with h2 (pip install "httpx[http2,brotli]"), so advertise
+# what we can actually handle.
+HTTP2 = importlib.util.find_spec("h2") is not None
+ACCEPT_ENCODING = (
+    "gzip, br"
+    if any(importlib.util.find_spec(m) for m in ("brotli", "brotlicffi"))
+    else "gzip"
+)
+# Transient failures are retried with jittered exponential backoff (and any
+# Retry-After the server sends) instead of being raised straight to the user.
+RETRY_ATTEMPTS = 6
+RETRY_MIN_WAIT = 1.0
+RETRY_MAX_WAIT = 30.0
+_RETRYABLE = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+_SLUG_RE = re.compile(r"[^0-9a-z]+")
+_TEXT_LINE_RE = re.compile(r"^[ \t]*(\S.*?)[ \t]*$", re.MULTILINE)
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough count for when tiktoken is unavailable: about 0.55 tokens per CJK
+    # character and 0.25 per other character.
+    cjk = len(_CJK_RE.findall(text))
+    return math.ceil(0.55 * cjk + 0.25 * (len(text) - cjk))
+
+
+def _http_client_options(max_connections: int, max_keepalive: int, timeout: float) -> dict:
+    return dict(
+        limits=httpx.Limits(
+            max_keepalive_connections=max_keepalive,
+            max_connections=max_connections,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+        headers={"Accept-Encoding": ACCEPT_ENCODING},
+        http2=HTTP2,
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _env_api_key() -> Optional[str]:
+    return os.getenv("OPENAI_API_KEY")
+
+
+def _digest(obj: object) -> str:
+    # Stable hash of a JSON-serialisable object, used for in-memory cache keys.
+    if orjson is not None:
+        data = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    else:
+        data = json.dumps(obj, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _retry_delay(exc: Exception, attempt: int) -> float:
+    # Full-jitter exponential backoff, but never sooner than Retry-After.
+    delay = max(RETRY_MIN_WAIT, random.uniform(0, min(RETRY_MAX_WAIT, RETRY_MIN_WAIT * 2 ** attempt)))
+    response = getattr(exc, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            try:
+                when = email.utils.parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                return delay  # unparseable; the jittered delay will do
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=datetime.timezone.utc)
+            delay = max(delay, when.timestamp() - time.time())
+    return delay
+
+
+def _normalise(vector: Sequence[float]) -> list[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
 
 
 # ---------------------------------------------------------------------------
@@ -12,7 +122,9 @@ import json
 
 class ConversationManager:
 
-    system_messages: dict[str, str] = {
+    # Read-only and shared by every instance; a user's custom prompt lives on
+    # the instance in _custom_message instead.
+    _SYSTEM_MESSAGES: Mapping[str, str] = MappingProxyType({
         "Dave": (
             "You are Dave, an exuberant, giddy assistant with ADHD! "
             "You speak in rapid bursts, sprinkle emojis and exclamation marks everywhere, "
@@ -28,9 +140,10 @@ class ConversationManager:
             "You are JARVIS, Tony Stark’s AI.  Speak with calm, clipped British precision, keep responses "
             "concise and highly competent, and proactively offer clarifications or next steps where helpful."
         ),
+    })
 
-        "Custom" : "",
-    }
+    PERSONA_NAMES: tuple[str, ...] = tuple(_SYSTEM_MESSAGES)
+    PERSONA_ERROR_LIST = ", ".join(PERSONA_NAMES)
 
     def __init__(self, 
                  api_key: Optional[str] = None,
@@ -43,24 +156,52 @@ class ConversationManager:
                  system_message: Optional[str] = None,
                  token_budget: int = 1024,
                  history_file: Optional[str] = None,
+                 max_connections: int = 100,
+                 max_keepalive: int = 20,
+                 timeout: float = 60.0,
+                 cache_replies: bool = False,
+                 embedder: Optional[Callable[[str], Sequence[float]]] = None,
+                 semantic_threshold: float = 0.9,
+                 history_strategy: str = "sliding",
+                 prewarm: bool = False,
                  ) -> None:
-        self.api_key: str | None = (
-            api_key if api_key is not None else os.getenv("OPENAI_API_KEY")
-        )
+        self._api_key_arg = api_key
 
         self.base_url = base_url        
         self.default_model = default_model
         self.default_temperature = default_temperature
         self.default_max_tokens = default_max_tokens
         self.token_budget = token_budget
-
-        if self.api_key is None:
+        if history_strategy not in self.HISTORY_STRATEGIES:
             raise ValueError(
-                "No API Key"
+                f"Unknown history strategy '{history_strategy}'. "
+                f"Valid options: {', '.join(self.HISTORY_STRATEGIES)}"
             )
+        self.history_strategy = history_strategy
+        self._summaries: dict[str, str] = {}
+        self.cache_replies = cache_replies
+        self.embedder = embedder
+        self.semantic_threshold = semantic_threshold
+        self._pending_context: list[str] = []
+        self._encoders: dict[str, tiktoken.Encoding] = {}
+        self._message_tokens: list[int] | None = None
+        self._tok_cache: dict[str, int] = {}
+        self._total_tokens = 0
+        self._dirty = False
+        self._last_save_ts = 0.0
+        self._debug_pretty = False
+        self._naming_done = False
+        self._stats: Counter[str] = Counter(dict.fromkeys(self.STAT_KEYS, 0))
+
+        self._pool_options = (max_connections, max_keepalive, timeout)
+        self._aclient: AsyncOpenAI | None = None
+        self._aclient_loop: asyncio.AbstractEventLoop | None = None
+        if prewarm:
+            self.warm_connection()
         
+        self._custom_message = system_message
         chosen_system = (
-            system_message or (self.system_messages.get(persona) if persona else None)
+            system_message or (self._SYSTEM_MESSAGES.get(persona) if persona else None)
         )
         self.system_message = chosen_system
         
@@ -71,7 +212,7 @@ class ConversationManager:
         self.load_conversation_history()
         if not self.conversation_history and self.system_message:
             self.conversation_history.append(
-                {"role": "user", "content": self.system_message}
+                {"role": "system", "content": self.system_message}
             )
 
     # ===================================================================
@@ -86,94 +227,815 @@ class ConversationManager:
         max_tokens: Optional[int] = None,
     ) -> str:
         
-        if not hasattr(self, "_client"):
-            from openai import OpenAI
-            self._client = OpenAI(api_key=self.api_key, base_url= self.base_url)
+        return "".join(self.stream_chat_completion(
+            prompt, model=model, temperature=temperature, max_tokens=max_tokens
+        )).strip()
+
+    def chat_completion_stream(self,
+        prompt: str,
+        on_delta: Callable[[str], None],
+        *,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        # Same as chat_completion, but hands each text fragment to on_delta as
+        # it arrives.
+        parts: list[str] = []
+        for delta in self.stream_chat_completion(
+            prompt, model=model, temperature=temperature, max_tokens=max_tokens
+        ):
+            parts.append(delta)
+            on_delta(delta)
+        return "".join(parts).strip()
+
+    def stream_chat_completion(self,
+        prompt: str,
+        *,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> Iterator[str]:
+        # Yields the reply text as it arrives. The reply is added to the
+        # history (and saved) once the iterator is exhausted; abandoning it
+        # early leaves only the user turn recorded.
+        client = self._client  # resolves the API key before history changes
+        params = self._start_turn(prompt, model, temperature, max_tokens)
+        key, probe, cached = self.lookup_reply(params)
+        if cached is not None:
+            yield cached
+            self._finish_turn(cached)
+            return
+
+        response = self._create_completion(client, params, stream=True)
+
+        parts: list[str] = []
+        for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+
+        assistant_content = "".join(parts).strip()
+        self.remember_reply(key, probe, assistant_content)
+        self._finish_turn(assistant_content)
 
-        self.conversation_history.append({"role": "user", "content": prompt})
+    def _start_turn(self,
+        prompt: str,
+        model: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+    ) -> dict:
+        self.append_message("user", prompt)
         self.enforce_token_budget()
 
-        response = self._client.chat.completions.create(
+        messages = self.messages_for_send()
+        compressed = self._compress_for_send(messages)
+        before = self.tokens_for_messages(messages, model)
+        self._stats["tokens_in_before_compression"] += before
+        self._stats["tokens_in_after_compression"] += (
+            before if compressed is messages else self.tokens_for_messages(compressed, model)
+        )
+        return self._request_params(compressed, model, temperature, max_tokens)
+
+    def inject_context(self, content: str) -> None:
+        # Extra context (retrieved notes, memories) for the next request only.
+        # It is sent as its own message just before the new user turn, never
+        # folded into the system prompt, so the system prompt and earlier turns
+        # stay a byte-identical prefix the provider's prompt cache can reuse.
+        self._pending_context.append(content)
+
+    COMPRESS_MIN_CHARS = 1500
+    COMPRESS_RECENT_KEEP = 4
+
+    def _compress_for_send(self,
+        messages: list[dict[str, str]],
+        recent_keep: int = COMPRESS_RECENT_KEEP,
+    ) -> list[dict[str, str]]:
+        # Older tool output and oversized assistant replies are cut to a
+        # one-line summary. The list is only copied once something actually
+        # needs replacing, so the usual case sends the history as is; the
+        # stored history is never modified, and the most recent turns are
+        # always sent verbatim.
+        out = messages
+        for i in range(len(messages) - recent_keep):
+            msg = messages[i]
+            if self._compressible(msg):
+                if out is messages:
+                    out = list(messages)
+                out[i] = self._summarise_message(msg)
+        return out
+
+    def _compressible(self, msg: dict[str, str]) -> bool:
+        role = msg["role"]
+        if role == "tool":
+            return True
+        return role == "assistant" and len(msg["content"]) > self.COMPRESS_MIN_CHARS
+
+    def _summarise_message(self, msg: dict[str, str]) -> dict[str, str]:
+        content = msg["content"]
+        lines = _TEXT_LINE_RE.findall(content)
+        first = lines[0][:120] if lines else ""
+        last = lines[-1][:120] if len(lines) > 1 else ""
+        status = " OK" if msg["role"] == "tool" else ""
+        summary = f"[{msg['role']}]{status} ({len(content)} chars) | {first}"
+        if last:
+            summary += f" → {last}"
+        return {**msg, "content": summary}
+
+    def messages_for_send(self) -> list[dict[str, str]]:
+        history = self.conversation_history
+        if not self._pending_context:
+            return history
+
+        context = [{"role": "system", "content": c} for c in self._pending_context]
+        self._pending_context = []
+        return history[:-1] + context + history[-1:]
+
+    def _request_params(self,
+        messages: list[dict],
+        model: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+    ) -> dict:
+        return dict(
             model=model or self.default_model,
             temperature=temperature if temperature is not None else self.default_temperature,
             max_tokens=max_tokens if max_tokens is not None else self.default_max_tokens,
-            messages=self.conversation_history,
+            messages=messages,
         )
 
-        assistant_content = response.choices[0].message.content.strip()
-        self.conversation_history.append(
-            {"role": "assistant", "content": assistant_content}
-        )
+    def one_shot_messages(self, prompt: str) -> list[dict[str, str]]:
+        # A single prompt under the current system message, without history.
+        messages = []
+        if self.system_message:
+            messages.append({"role": "system", "content": self.system_message})
+        messages.append({"role": "user", "content": prompt})
+        return messages
 
-        self.enforce_token_budget()
+    def _finish_turn(self, assistant_content: str) -> str:
+        self.append_message("assistant", assistant_content)
+
+        # _start_turn already trimmed to budget, so only the reply can push
+        # the running total over.
+        if self._total_tokens > self.token_budget:
+            self.enforce_token_budget()
         self.save_conversation_history()
 
         return assistant_content
 
+    def _create_completion(self,
+        client: OpenAI,
+        params: dict,
+        *,
+        attempts: int = RETRY_ATTEMPTS,
+        **extra: object,
+    ):
+        # Retries only the request itself; once a stream has started, its
+        # chunks may already have been shown, so it is never re-sent.
+        # api_seconds covers retries and, for streams, ends at the first byte.
+        # The SDK's own retries are turned off here only, so the two loops
+        # don't stack; other endpoints keep them.
+        client = client.with_options(max_retries=0)
+        self._stats["api_calls"] += 1
+        start = time.perf_counter()
+        try:
+            for attempt in range(attempts):
+                try:
+                    return client.chat.completions.create(**params, **extra)
+                except _RETRYABLE as exc:
+                    if attempt == attempts - 1:
+                        raise
+                    delay = _retry_delay(exc, attempt)
+                    logging.debug("Retrying in %.1fs after %s", delay, exc)
+                    self._stats["api_retries"] += 1
+                    time.sleep(delay)
+        finally:
+            self._stats["api_seconds"] += time.perf_counter() - start
+
+    # ===================================================================
+    # Async chat flow
+    # ===================================================================
+
+    async def achat_completion(self,
+        prompt: str,
+        *,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        # Starting and finishing a turn can make blocking API calls (history
+        # summaries, file naming) and write to disk, so they run in a thread
+        # rather than stalling the event loop.
+        client = self.async_client()  # resolves the API key before history changes
+        params = await asyncio.to_thread(
+            self._start_turn, prompt, model, temperature, max_tokens
+        )
+        key, probe, cached = self.lookup_reply(params)
+        if cached is not None:
+            return await asyncio.to_thread(self._finish_turn, cached)
+
+        response = await self._acreate_completion(client, params)
+
+        assistant_content = response.choices[0].message.content.strip()
+        self.remember_reply(key, probe, assistant_content)
+        return await asyncio.to_thread(self._finish_turn, assistant_content)
+
+    async def batch_chat(self,
+        prompts: Iterable[str],
+        max_concurrency: int = 10,
+        *,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> list[str | BaseException]:
+        # Independent prompts fanned out concurrently. Each one is sent as a
+        # one-shot under the current system message and does not touch the
+        # conversation history, which concurrent turns could not share.
+        # Failures come back in place as exception objects.
+        sem = asyncio.Semaphore(max_concurrency)
+
+        async def one(prompt: str) -> str:
+            async with sem:
+                params = self._request_params(
+                    self.one_shot_messages(prompt), model, temperature, max_tokens
+                )
+                response = await self._acreate_completion(self.async_client(), params)
+                return response.choices[0].message.content.strip()
+
+        return await asyncio.gather(*(one(p) for p in prompts), return_exceptions=True)
+
+    async def _acreate_completion(self,
+        client: AsyncOpenAI,
+        params: dict,
+        *,
+        attempts: int = RETRY_ATTEMPTS,
+        **extra: object,
+    ):
+        client = client.with_options(max_retries=0)
+        self._stats["api_calls"] += 1
+        start = time.perf_counter()
+        try:
+            for attempt in range(attempts):
+                try:
+                    return await client.chat.completions.create(**params, **extra)
+                except _RETRYABLE as exc:
+                    if attempt == attempts - 1:
+                        raise
+                    delay = _retry_delay(exc, attempt)
+                    logging.debug("Retrying in %.1fs after %s", delay, exc)
+                    self._stats["api_retries"] += 1
+                    await asyncio.sleep(delay)
+        finally:
+            self._stats["api_seconds"] += time.perf_counter() - start
+
+    def async_client(self) -> AsyncOpenAI:
+        # An httpx.AsyncClient's connections belong to the loop that opened
+        # them, so the client is rebuilt whenever it is used from a different
+        # loop (e.g. a second asyncio.run). The old one's loop is usually
+        # closed by then, so it is dropped rather than closed.
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient_loop = loop
+            http_client = httpx.AsyncClient(**_http_client_options(*self._pool_options))
+            self._aclient = AsyncOpenAI(
+                api_key=self.api_key, base_url=self.base_url, http_client=http_client
+            )
+        return self._aclient
+
+    async def aclose(self) -> None:
+        await asyncio.to_thread(self.flush)
+        if self._aclient is not None and self._aclient_loop is asyncio.get_running_loop():
+            await self._aclient.close()
+        self._aclient = self._aclient_loop = None
+
+    # ===================================================================
+    # Reply Cache
+    # ===================================================================
+
+    # Exact matches are keyed on the full request (endpoint, model, sampling
+    # params and every message), so the LRU is safe to share across managers;
+    # new chats asking the same opening question hit it too. Caching is
+    # opt-in (cache_replies=True): a hit replays an earlier reply, which
+    # hides the variety a non-zero temperature asks for.
+    REPLY_CACHE_SIZE = 512
+    _reply_cache: OrderedDict[str, str] = OrderedDict()
+    # Near matches, shared the same way: (scope, prompt vector, context
+    # vector or None, reply). Guarded by the same lock.
+    _semantic_entries: list[tuple[str, list[float], Optional[list[float]], str]] = []
+    _reply_cache_lock = threading.Lock()
+
+    def reply_cache_key(self, params: dict) -> str:
+        return _digest([
+            self.base_url, params["model"], params["temperature"],
+            params["max_tokens"], params["messages"],
+        ])
+
+    def _semantic_probe(self, params: dict) -> tuple[str, list[float], Optional[list[float]]]:
+        # A bare "yes" or "go on" only means something after the exchange it
+        # answers, so a near match needs both a similar prompt and a similar
+        # previous user/assistant exchange (or none on both sides).
+        messages = params["messages"]
+        scope = _digest([self.base_url, params["model"], self.system_message])
+        prompt = _normalise(self.embedder(messages[-1]["content"]))
+        turns = [m for m in messages[:-1] if m["role"] in ("user", "assistant")]
+        context = None
+        if turns:
+            context = _normalise(self.embedder(
+                "\n".join(f'{m["role"]}: {m["content"]}' for m in turns[-2:])
+            ))
+        return scope, prompt, context
+
+    def lookup_reply(self,
+        params: dict,
+    ) -> tuple[str, Optional[tuple[str, list[float], Optional[list[float]]]], Optional[str]]:
+        # Returns (key, semantic probe, cached reply or None); pass the first
+        # two to remember_reply. Must run before the reply is appended, since
+        # params["messages"] is the live history.
+        if not self.cache_replies:
+            self._stats["cache_skipped"] += 1
+            return "", None, None
+
+        key = self.reply_cache_key(params)
+        with self._reply_cache_lock:
+            reply = self._reply_cache.get(key)
+            if reply is not None:
+                self._reply_cache.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return key, None, reply
+
+        probe = None
+        if self.embedder is not None:
+            probe = self._semantic_probe(params)
+            reply = self.semantic_match(*probe)
+        self._stats["cache_hits" if reply is not None else "cache_misses"] += 1
+        return key, probe, reply
+
+    def remember_reply(self,
+        key: str,
+        probe: Optional[tuple[str, list[float], Optional[list[float]]]],
+        reply: str,
+    ) -> None:
+        if not key:
+            return  # caching is off
+
+        with self._reply_cache_lock:
+            self._reply_cache[key] = reply
+            self._reply_cache.move_to_end(key)
+            while len(self._reply_cache) > self.REPLY_CACHE_SIZE:
+                self._reply_cache.popitem(last=False)
+
+            if probe is not None:
+                self._semantic_entries.append((*probe, reply))
+                del self._semantic_entries[:-self.REPLY_CACHE_SIZE]
+
+    def semantic_match(self,
+        scope: str,
+        vector: list[float],
+        context: Optional[list[float]] = None,
+    ) -> Optional[str]:
+        # Nearest earlier prompt in the same scope, by cosine similarity
+        # (vectors are stored normalised, so a dot product). The previous
+        # exchange must clear the same threshold.
+        best_score, best_reply = self.semantic_threshold, None
+        with self._reply_cache_lock:
+            entries = list(self._semantic_entries)
+        for other_scope, other, other_context, reply in entries:
+            if other_scope != scope or (context is None) != (other_context is None):
+                continue
+            if context is not None and (
+                sum(a * b for a, b in zip(context, other_context)) < self.semantic_threshold
+            ):
+                continue
+            score = sum(a * b for a, b in zip(vector, other))
+            if score >= best_score:
+                best_score, best_reply = score, reply
+        return best_reply
+
+    # ===================================================================
+    # Batch API
+    # ===================================================================
+
+    BATCH_ENDPOINT = "/v1/chat/completions"
+    BATCH_FAILED_STATES = ("failed", "expired", "cancelled")
+
+    def submit_batch(self,
+        prompts: Iterable[str],
+        *,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        # Queues independent one-shot prompts on OpenAI's Batch API (cheaper,
+        # completes within 24h) and returns the batch id for fetch_batch.
+        # Each request's custom_id is the prompt's index as a string.
+        lines = []
+        for i, prompt in enumerate(prompts):
+            params = self._request_params(
+                self.one_shot_messages(prompt), model, temperature, max_tokens
+            )
+            lines.append(json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": self.BATCH_ENDPOINT,
+                "body": {k: v for k, v in params.items() if v is not None},
+            }, ensure_ascii=False))
+        if not lines:
+            raise ValueError("submit_batch needs at least one prompt.")
+
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        batch_file = self._client.files.create(file=("batch.jsonl", data), purpose="batch")
+        batch = self._client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=self.BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        self._stats["batch_submissions"] += 1
+        return batch.id
+
+    def fetch_batch(self,
+        batch_id: str,
+        *,
+        wait: bool = False,
+        poll_interval: float = 30.0,
+    ) -> Optional[dict[str, Optional[str]]]:
+        # Returns {custom_id: reply} once the batch has completed (None for
+        # requests that errored), or None if it is still running and wait is
+        # False. With wait=True, polls every poll_interval seconds.
+        while True:
+            batch = self._client.batches.retrieve(batch_id)
+            if batch.status == "completed":
+                break
+            if batch.status in self.BATCH_FAILED_STATES:
+                raise RuntimeError(f"Batch {batch_id} {batch.status}.")
+            if not wait:
+                return None
+            time.sleep(poll_interval)
+
+        results: dict[str, Optional[str]] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self._client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                response = row.get("response") or {}
+                if response.get("status_code") == 200:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    results[row["custom_id"]] = content.strip()
+                else:
+                    results[row["custom_id"]] = None
+        return results
+
+    # ===================================================================
+    # Shared Client
+    # ===================================================================
+
+    # The key and client are resolved on first use, so managers that only
+    # read or edit history never need a key.
+    @functools.cached_property
+    def api_key(self) -> str:
+        key = self._api_key_arg if self._api_key_arg is not None else _env_api_key()
+        if key is None:
+            raise ValueError(
+                "No API Key"
+            )
+        return key
+
+    @property
+    def _client_key(self) -> tuple:
+        return (self.api_key, self.base_url, *self._pool_options)
+
+    @functools.cached_property
+    def _client(self) -> OpenAI:
+        return self.shared_client(*self._client_key)
+
+    # One client (and so one HTTP connection pool) per key/endpoint/pool
+    # settings, shared by every manager so switching chats keeps the warm TLS
+    # connection.
+    _clients: dict[tuple, OpenAI] = {}
+    _warmed: set[tuple] = set()
+
+    @classmethod
+    def shared_client(cls,
+        api_key: str,
+        base_url: str,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        timeout: float = 60.0,
+    ) -> OpenAI:
+        key = (api_key, base_url, max_connections, max_keepalive, timeout)
+        client = cls._clients.get(key)
+        if client is None:
+            http_client = httpx.Client(
+                **_http_client_options(max_connections, max_keepalive, timeout)
+            )
+            client = cls._clients.setdefault(
+                key, OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+            )
+        return client
+
+    def close(self) -> None:
+        # Writes any debounced history and drops this manager's clients. The
+        # sync client is shared with other managers, so it stays open; call
+        # close_shared_clients() once at shutdown. The async client can only
+        # be closed on its own loop, so await aclose() there to close it
+        # cleanly; by the time close() runs, that loop has usually finished.
+        self.flush()
+        self.__dict__.pop("_client", None)
+        self._aclient = self._aclient_loop = None
+
+    @classmethod
+    def close_shared_clients(cls) -> None:
+        # Closes every pooled client. Managers still holding one will fail
+        # their next request, so only call this when all of them are done.
+        clients = list(cls._clients.values())
+        cls._clients.clear()
+        cls._warmed.clear()
+        for client in clients:
+            client.close()
+
+    def warm_connection(self) -> None:
+        # Opens the pooled TCP+TLS connection from a background thread so the
+        # first real request skips the handshake. Once per shared client.
+        if self._client_key in self._warmed:
+            return
+        self._warmed.add(self._client_key)
+        threading.Thread(target=self._warm, daemon=True).start()
+
+    def _warm(self) -> None:
+        try:
+            self._client.with_options(max_retries=0).models.list()
+        except Exception as exc:
+            logging.debug("Connection pre-warm failed: %s", exc)
+
+    def __enter__(self) -> ConversationManager:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
     # ===================================================================
     # Token Manage
     # ===================================================================
 
-    def encode_for(self, model: Optional[str] = None):
+    _tiktoken = None  # imported on first use to keep GUI start-up fast; False if missing
+
+    def encode_for(self, model: Optional[str] = None) -> tiktoken.Encoding:
         model = model or self.default_model
+        enc = self._encoders.get(model)
+        if enc is not None:
+            return enc
+
+        tiktoken = self._tiktoken
+        if tiktoken is None:
+            import tiktoken
+            ConversationManager._tiktoken = tiktoken
+
         try:
-            return tiktoken.encoding_for_model(model)
+            enc = tiktoken.encoding_for_model(model)
         except KeyError:
             fallback = "o200k_base" if model.startswith("gpt-4o") else "cl100k_base"
-            return tiktoken.get_encoding(fallback)
+            enc = tiktoken.get_encoding(fallback)
+        return self._encoders.setdefault(model, enc)
+
+    def count_texts(self, texts: list[str], model: Optional[str] = None) -> list[int]:
+        # Counts for the default model are memoized by content, so recounting
+        # the history (after a load, a persona switch, or for the debug total)
+        # only encodes text that has not been seen before.
+        if model is not None and model != self.default_model:
+            return self._encode_counts(texts, model)
 
-    def count_tokens(self, text: str, model: Optional[str] = None) -> None:
-        return len(self.encode_for(model).encode(text))
+        cache = self._tok_cache
+        missing = [text for text in dict.fromkeys(texts) if text not in cache]
+        if missing:
+            cache.update(zip(missing, self._encode_counts(missing, None)))
+        return [cache[text] for text in texts]
+
+    def _encode_counts(self, texts: list[str], model: Optional[str]) -> list[int]:
+        if self._tiktoken is not False:
+            try:
+                enc = self.encode_for(model)
+            except ImportError:
+                ConversationManager._tiktoken = False  # estimate from now on
+            else:
+                # One call into tiktoken's Rust core, which tokenizes in parallel.
+                encoded = enc.encode_ordinary_batch(texts, num_threads=ENCODE_THREADS)
+                return [len(tokens) for tokens in encoded]
+        return [estimate_tokens(text) for text in texts]
+
+    def count_tokens(self, text: str, model: Optional[str] = None) -> int:
+        return self.count_texts([text], model)[0]
 
     def tokens_for_messages(self, messages: list[dict], model: Optional[str] = None) -> int:
-        enc = self.encode_for(model)
         tokens_per_message, tokens_per_name = 3, 1
-        total = 0
+        total = tokens_per_message * len(messages)
 
+        total += sum(self.count_texts([msg["content"] for msg in messages], model))
         for msg in messages:
-            total += tokens_per_message
-            total += len(enc.encode(msg["content"]))
             if name := msg.get("name"):
-                total += len(enc.encode(name)) + tokens_per_name
+                total += self.count_tokens(name, model) + tokens_per_name
         return total + 3
     
     def enforce_token_budget(self) -> None:
-        enc = tiktoken.encoding_for_model(self.default_model)
-        while (
-            enc.encode("\n".join(msg["content"] for msg in self.conversation_history)).__len__() 
-            > self.token_budget and len(self.conversation_history) > 1):
+        self.compress_history()
+
+    def message_token_counts(self) -> list[int]:
+        # Per-message counts parallel to conversation_history, built lazily
+        # and then kept in step by append_message / compress_history.
+        # conversation_history is public, so rebuild if someone changed its
+        # length behind our back rather than trimming against stale counts.
+        if (
+            self._message_tokens is None
+            or len(self._message_tokens) != len(self.conversation_history)
+        ):
+            contents = [msg["content"] for msg in self.conversation_history]
+            self._message_tokens = self.count_texts(contents)
+            self._total_tokens = sum(self._message_tokens)
+        return self._message_tokens
+
+    def append_message(self, role: str, content: str) -> None:
+        self.conversation_history.append({"role": role, "content": content})
+        self._dirty = True
+        if self._message_tokens is not None:
+            tokens = self.count_tokens(content)
+            self._message_tokens.append(tokens)
+            self._total_tokens += tokens
+
+    # ===================================================================
+    # History Compression
+    # ===================================================================
+
+    HISTORY_STRATEGIES = ("sliding", "summarize", "hierarchical")
+    KEEP_RECENT = 4
+    SUMMARY_MAX_TOKENS = 256
+    ROLE_WEIGHTS = {"system": 1.0, "user": 0.7, "assistant": 0.5, "tool": 0.2}
+
+    def compress_history(self,
+        strategy: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        keep_recent: int = KEEP_RECENT,
+    ) -> None:
+        # Brings the history under max_tokens (default: token_budget). Index 0
+        # (the system/persona message) is always kept. "sliding" drops the
+        # oldest turns; "summarize" folds everything but the last keep_recent
+        # messages into one cached summary; "hierarchical" drops the older
+        # messages that score lowest on recency, role and word density. Any
+        # strategy that still leaves the history over budget is followed by
+        # sliding.
+        strategy = strategy or self.history_strategy
+        if strategy not in self.HISTORY_STRATEGIES:
+            raise ValueError(
+                f"Unknown history strategy '{strategy}'. "
+                f"Valid options: {', '.join(self.HISTORY_STRATEGIES)}"
+            )
+        budget = self.token_budget if max_tokens is None else max_tokens
+
+        self.message_token_counts()
+        if self._total_tokens <= budget:
+            return
+
+        if strategy == "summarize":
+            self._summarize_older(keep_recent)
+        elif strategy == "hierarchical":
+            self._drop_low_value(budget, keep_recent)
+        self._drop_oldest(budget)
+        self._prune_token_cache()
+
+    def _prune_token_cache(self) -> None:
+        # Forget counts for text that has left the history, once the cache has
+        # grown well past the history's size.
+        history = self.conversation_history
+        if len(self._tok_cache) > 2 * len(history) + 16:
+            live = {msg["content"] for msg in history}
+            self._tok_cache = {t: c for t, c in self._tok_cache.items() if t in live}
+
+    def _drop_oldest(self, budget: int) -> None:
+        counts = self.message_token_counts()
+        while self._total_tokens > budget and len(self.conversation_history) > 1:
             self.conversation_history.pop(1)
+            self._total_tokens -= counts.pop(1)
+            self._dirty = True
+
+    def _summarize_older(self, keep_recent: int) -> None:
+        history = self.conversation_history
+        counts = self.message_token_counts()
+        end = len(history) - keep_recent
+        if end <= 2:
+            return  # fewer than two older messages; nothing to fold
+
+        summary = self._summary_for(history[1:end])
+        if summary is None:
+            return
+
+        summary_msg = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+        counts[1:end] = [self.count_tokens(summary_msg["content"])]
+        history[1:end] = [summary_msg]
+        self._total_tokens = sum(counts)
+        self._dirty = True
+
+    def _summary_for(self, messages: list[dict[str, str]]) -> Optional[str]:
+        # Cached by the exact range, so re-triggering on the same messages is free.
+        key = _digest(messages)
+        summary = self._summaries.get(key)
+        if summary is not None:
+            return summary
+
+        transcript = "\n".join(f'{m["role"]}: {m["content"]}' for m in messages)
+        try:
+            resp = self._create_completion(self._client, dict(
+                model=self.default_model,
+                temperature=0.0,
+                max_tokens=self.SUMMARY_MAX_TOKENS,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "Summarise this conversation excerpt in a few sentences. "
+                            "Keep names, facts, decisions and open questions."
+                        ),
+                    },
+                    {"role": "user", "content": transcript},
+                ],
+            ))
+            summary = resp.choices[0].message.content.strip()
+        except Exception as exc:
+            logging.debug("Failed to summarise history: %s", exc)
+            return None
+
+        self._summaries[key] = summary
+        return summary
+
+    def _drop_low_value(self, budget: int, keep_recent: int) -> None:
+        history = self.conversation_history
+        counts = self.message_token_counts()
+        end = len(history) - keep_recent
+        if end <= 1:
+            return
+
+        ranked = sorted(range(1, end), key=lambda i: self._importance(history[i], i, end))
+        drop, total = set(), self._total_tokens
+        for i in ranked:
+            if total <= budget:
+                break
+            drop.add(i)
+            total -= counts[i]
+        if not drop:
+            return
+
+        history[:] = [msg for i, msg in enumerate(history) if i not in drop]
+        counts[:] = [c for i, c in enumerate(counts) if i not in drop]
+        self._total_tokens = total
+        self._dirty = True
+
+    def _importance(self, msg: dict[str, str], index: int, end: int) -> float:
+        words = msg["content"].split()
+        density = len(set(words)) / len(words) if words else 0.0
+        recency = index / end
+        return 0.5 * recency + 0.3 * self.ROLE_WEIGHTS.get(msg["role"], 0.5) + 0.2 * density
 
     # ===================================================================
     # Persona Helpers
     # ===================================================================
 
+    @property
+    def system_messages(self) -> Mapping[str, str]:
+        return self._SYSTEM_MESSAGES
+
     def set_persona(self, persona: str) -> None:
-        if persona not in self.system_messages or persona == "Custom":
+        if persona == "Custom" and self._custom_message:
+            self.system_message = self._custom_message
+        elif persona in self._SYSTEM_MESSAGES:
+            self.system_message = self._SYSTEM_MESSAGES[persona]
+        else:
             raise ValueError(
                 f"Unknown persona '{persona}'. "
-                f"Valid options: {', '.join(k for k in self.system_messages if k != 'Custom')}"
+                f"Valid options: {self.PERSONA_ERROR_LIST}"
             )
-        self.system_message = self.system_messages[persona]
         self.update_system_message_in_history()
 
     def set_custom_system_message(self, message: str) -> None:
         if not isinstance(message, str) or not message.strip():
             raise ValueError("Custom system message cannot be empty.")
         
-        self.system_messages["Custom"] = message.strip()
-        self.system_message = self.system_messages["Custom"]
+        self._custom_message = message.strip()
+        self.system_message = self._custom_message
         self.update_system_message_in_history()
 
     def update_system_message_in_history(self) -> None:
-        for entry in self.conversation_history:
-            if entry.get("role") == "system":
-                entry["content"] = self.system_message
-                break
+        # The system message is only ever inserted at index 0.
+        history = self.conversation_history
+        if history and history[0].get("role") == "system":
+            history[0]["content"] = self.system_message
         else:
-            self.conversation_history.insert(
+            history.insert(
                 0, {"role": "system", "content": self.system_message}
             )
+        self._message_tokens = None
+        self._dirty = True
         self.save_conversation_history()
 
     # ===================================================================
@@ -188,12 +1050,36 @@ class ConversationManager:
                 self.conversation_history = data
         except (FileNotFoundError, json.JSONDecodeError):
             self.conversation_history = []
+        self._message_tokens = None
+
+    SAVE_INTERVAL = 2.0  # seconds between debounced writes
+
+    def save_conversation_history(self, *, force: bool = False) -> None:
+        if not self._dirty:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_save_ts < self.SAVE_INTERVAL:
+            return  # picked up by the next save or by flush()
+
+        if self._debug_pretty:
+            data = json.dumps(self.conversation_history, ensure_ascii=False, indent=2)
+        else:
+            data = json.dumps(
+                self.conversation_history, ensure_ascii=False, separators=(",", ":")
+            )
+
+        tmp_path = self.history_file + ".tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(data.encode("utf-8"))
+        os.replace(tmp_path, self.history_file)
+
+        self._dirty = False
+        self._last_save_ts = now
 
-    def save_conversation_history(self) -> None:
         self.maybe_generate_descriptive_filename()
 
-        with open(self.history_file, "w", encoding= "utf-8") as fp:
-            json.dump(self.conversation_history, fp, ensure_ascii=False, indent = 2)
+    def flush(self) -> None:
+        self.save_conversation_history(force=True)
 
     # ===================================================================
     # FileName Helper
@@ -205,19 +1091,32 @@ class ConversationManager:
         now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         return os.path.join("history", f"{self.TIMESTAMP_PLACEHOLDER}{now}.json")
     
+    NAMING_MIN_MESSAGES = 4  # two exchanges before asking for a title
+
     def maybe_generate_descriptive_filename(self) -> None:
+        if self._naming_done:
+            return
         placeholder_prefix = os.path.join("history", self.TIMESTAMP_PLACEHOLDER)
         if not self.history_file.startswith(placeholder_prefix):
+            self._naming_done = True
             return  # already renamed once
+        if len(self.conversation_history) < self.NAMING_MIN_MESSAGES:
+            return
+
+        # One attempt per session; a failed rename is not retried every save.
+        self._naming_done = True
 
     # ---- 1. Build a short context excerpt ---------------------------------
         EXCERPT_TOKENS = 120            # ~400-450 characters; stays well < max 4096
+        segments = [
+            f'{msg["role"]}: {msg["content"]}'
+            for msg in self.conversation_history
+            if msg["role"] != "system"
+        ]
+        counts = self.count_texts(segments)
         excerpt_parts, running_tokens = [], 0
-        for msg in self.conversation_history:
-            if msg["role"] == "system":
-                continue
-            segment = f'{msg["role"]}: {msg["content"]}'
-            running_tokens += self.count_tokens(segment)
+        for segment, tokens in zip(segments, counts):
+            running_tokens += tokens
             excerpt_parts.append(segment)
             if running_tokens >= EXCERPT_TOKENS:
                 break
@@ -226,18 +1125,9 @@ class ConversationManager:
             return
         excerpt = "\n".join(excerpt_parts)
 
-    # ---- 2. Lazily create OpenAI client ------------------------------------
-        if not hasattr(self, "_client"):
-            try:
-                from openai import OpenAI
-                self._client = OpenAI(api_key=self.api_key, base_url=self.base_url)
-            except Exception as exc:
-                logging.debug("Unable to create OpenAI client: %s", exc)
-                return
-
-    # ---- 3. Ask the model for a slug ---------------------------------------
+    # ---- 2. Ask the model for a slug ---------------------------------------
         try:
-            resp = self._client.chat.completions.create(
+            resp = self._create_completion(self._client, dict(
                 model=self.default_model,
                 temperature=0.0,
                 max_tokens=8,          # we only expect a few words
@@ -252,27 +1142,80 @@ class ConversationManager:
                 },
                 {"role": "user", "content": excerpt},
             ],
-        )
+        ), attempts=1)  # best-effort, and it holds up _finish_turn
             raw_title = resp.choices[0].message.content.strip().lower()
         except Exception as exc:
             logging.debug("Failed to get filename from OpenAI: %s", exc)
             return
 
-    # ---- 4. Sanitise & uniquify --------------------------------------------
-        slug = "".join(c if c.isalnum() else "_" for c in raw_title).strip("_")
-        slug = "_".join(filter(None, slug.split("_")))[:50] or "chat"
+    # ---- 3. Sanitise & uniquify --------------------------------------------
+        slug = _SLUG_RE.sub("_", raw_title).strip("_")[:50] or "chat"
+
+        # Probe names against one directory snapshot, then claim the chosen
+        # name with O_EXCL so a concurrent writer cannot take it between the
+        # check and the rename.
+        try:
+            with os.scandir("history") as it:
+                taken = {e.name for e in it}
+        except OSError:
+            taken = set()
 
-        new_path = os.path.join("history", f"{slug}.json")
-        counter = 1
-        while os.path.exists(new_path):
-            new_path = os.path.join("history", f"{slug}_{counter}.json")
+        counter = 0
+        while True:
+            name = f"{slug}.json" if counter == 0 else f"{slug}_{counter}.json"
             counter += 1
+            if name in taken:
+                continue
+            new_path = os.path.join("history", name)
+            try:
+                os.close(os.open(new_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+                break
+            except FileExistsError:
+                continue  # created since the snapshot
+            except OSError as exc:
+                logging.debug("Unable to claim history file name: %s", exc)
+                return
 
         try:
-            os.rename(self.history_file, new_path)
+            os.replace(self.history_file, new_path)
             self.history_file = new_path
         except Exception as exc:
-            logging.debug("Unable to rename history file: %s", exc)   
+            logging.debug("Unable to rename history file: %s", exc)
+            try:
+                os.remove(new_path)  # drop the empty placeholder we claimed
+            except OSError:
+                pass   
+
+
+    # ===================================================================
+    # Stats
+    # ===================================================================
+
+    STAT_KEYS = (
+        "cache_hits",
+        "cache_misses",
+        "cache_skipped",  # lookups made with cache_replies off
+        "tokens_in_before_compression",
+        "tokens_in_after_compression",
+        "batch_submissions",
+        "api_calls",
+        "api_retries",
+        "api_seconds",
+    )
+
+    def get_stats(self) -> dict[str, float]:
+        # Counters since construction or the last reset_stats(). API counts
+        # and timings cover every chat completion request, including history
+        # summaries and file naming; token counts cover what chat turns sent
+        # before and after _compress_for_send.
+        stats = dict(self._stats)
+        before = self._stats["tokens_in_before_compression"]
+        after = self._stats["tokens_in_after_compression"]
+        stats["compression_ratio"] = after / before if before else 1.0
+        return stats
+
+    def reset_stats(self) -> None:
+        self._stats = Counter(dict.fromkeys(self.STAT_KEYS, 0))
 
 
 #Debug